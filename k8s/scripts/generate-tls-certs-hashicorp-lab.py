@@ -5,96 +5,217 @@ and update Kubernetes secret YAML files with base64-encoded values.
 """
 
 import subprocess
-import base64
+import datetime
+import ipaddress
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from pathlib import Path
+from string import Template
 
-# Certificate configurations
-CERTS_CONFIG = [
-    {
-        'name': 'boundary',
-        'domain': 'boundary.hashicorp.lab',
-        'san': 'DNS:boundary.hashicorp.lab,DNS:localhost,IP:127.0.0.1',
-        'yaml_file': 'k8s/platform/boundary/manifests/09-tls-secret.yaml',
-        'namespace': 'boundary',
-        'secret_name': 'boundary-tls'
-    },
-    {
-        'name': 'boundary-worker',
-        'domain': 'boundary-worker.hashicorp.lab',
-        'san': 'DNS:boundary-worker.hashicorp.lab,DNS:localhost,IP:127.0.0.1',
-        'yaml_file': 'k8s/platform/boundary/manifests/11-worker-tls-secret.yaml',
-        'namespace': 'boundary',
-        'secret_name': 'boundary-worker-tls'
-    },
-    {
-        'name': 'keycloak',
-        'domain': 'keycloak.hashicorp.lab',
-        'san': 'DNS:keycloak.hashicorp.lab,DNS:localhost,IP:127.0.0.1',
-        'yaml_file': 'k8s/platform/keycloak/manifests/07-tls-secret.yaml',
-        'namespace': 'keycloak',
-        'secret_name': 'keycloak-tls'
-    },
-    {
-        'name': 'vault',
-        'domain': 'vault.hashicorp.lab',
-        'san': 'DNS:vault.hashicorp.lab,DNS:localhost,IP:127.0.0.1',
-        'yaml_file': 'k8s/platform/vault/manifests/08-tls-secret.yaml',
-        'namespace': 'vault',
-        'secret_name': 'vault-tls'
-    }
-]
+# pybase64 is a drop-in, SIMD-accelerated replacement for the stdlib module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Generate keys and certificates in-process when the cryptography package is
+# available; otherwise fall back to one openssl CLI call per certificate
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+except ImportError:
+    x509 = None
 
 TEMP_DIR = '/tmp/hashicorp-lab-certs'
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-def generate_certificate(name, domain, san):
-    """Generate a self-signed certificate."""
-    key_file = os.path.join(TEMP_DIR, f'{name}.key')
-    crt_file = os.path.join(TEMP_DIR, f'{name}.crt')
+@dataclass(frozen=True)
+class CertConfig:
+    """A certificate to generate and the Kubernetes secret manifest it goes into."""
+    name: str
+    domain: str
+    san: str
+    yaml_file: str
+    namespace: str
+    secret_name: str
+    key_path: str = field(init=False)
+    crt_path: str = field(init=False)
 
-    cmd = [
-        'openssl', 'req', '-x509', '-nodes', '-days', '365',
-        '-newkey', 'rsa:2048',
-        '-keyout', key_file,
-        '-out', crt_file,
-        '-subj', f'/CN={domain}',
-        '-addext', f'subjectAltName={san}'
-    ]
+    def __post_init__(self):
+        object.__setattr__(self, 'key_path', f'{TEMP_DIR}/{self.name}.key')
+        object.__setattr__(self, 'crt_path', f'{TEMP_DIR}/{self.name}.crt')
+
+# Certificate configurations
+CERTS_CONFIG = (
+    CertConfig(
+        name='boundary',
+        domain='boundary.hashicorp.lab',
+        san='DNS:boundary.hashicorp.lab,DNS:localhost,IP:127.0.0.1',
+        yaml_file='k8s/platform/boundary/manifests/09-tls-secret.yaml',
+        namespace='boundary',
+        secret_name='boundary-tls'
+    ),
+    CertConfig(
+        name='boundary-worker',
+        domain='boundary-worker.hashicorp.lab',
+        san='DNS:boundary-worker.hashicorp.lab,DNS:localhost,IP:127.0.0.1',
+        yaml_file='k8s/platform/boundary/manifests/11-worker-tls-secret.yaml',
+        namespace='boundary',
+        secret_name='boundary-worker-tls'
+    ),
+    CertConfig(
+        name='keycloak',
+        domain='keycloak.hashicorp.lab',
+        san='DNS:keycloak.hashicorp.lab,DNS:localhost,IP:127.0.0.1',
+        yaml_file='k8s/platform/keycloak/manifests/07-tls-secret.yaml',
+        namespace='keycloak',
+        secret_name='keycloak-tls'
+    ),
+    CertConfig(
+        name='vault',
+        domain='vault.hashicorp.lab',
+        san='DNS:vault.hashicorp.lab,DNS:localhost,IP:127.0.0.1',
+        yaml_file='k8s/platform/vault/manifests/08-tls-secret.yaml',
+        namespace='vault',
+        secret_name='vault-tls'
+    )
+)
+
+# Multiple of 3 so encoded chunks concatenate without inner padding
+B64_CHUNK_SIZE = 57 * 1024
 
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        print(f"✓ Generated certificate for {name}")
-        return key_file, crt_file
-    except subprocess.CalledProcessError as e:
-        print(f"✗ Error generating certificate for {name}: {e.stderr}")
-        raise
-
-def base64_encode_file(filepath):
-    """Read file and return base64-encoded content."""
-    with open(filepath, 'rb') as f:
-        return base64.b64encode(f.read()).decode('ascii')
-
-def generate_k8s_secret_yaml(config, crt_b64, key_b64):
-    """Generate Kubernetes TLS secret YAML content."""
-    yaml_content = f"""# Self-signed TLS certificate for {config['domain']}
-# Generated with: openssl req -x509 -nodes -days 365 -newkey rsa:2048 \\
-#   -keyout {config['name']}.key -out {config['name']}.crt \\
-#   -subj "/CN={config['domain']}" \\
-#   -addext "subjectAltName={config['san']}"
+# Secret manifest up to the data fields, which are streamed in afterwards
+SECRET_YAML_HEADER = Template("""\
+# Self-signed TLS certificate for $domain
+# Generated with: openssl req -x509 -nodes -days 365 \\
+#   -newkey ec -pkeyopt ec_paramgen_curve:prime256v1 \\
+#   -keyout $name.key -out $name.crt \\
+#   -subj "/CN=$domain" \\
+#   -addext "subjectAltName=$san"
 apiVersion: v1
 kind: Secret
 metadata:
-  name: {config['secret_name']}
-  namespace: {config['namespace']}
+  name: $secret_name
+  namespace: $namespace
   labels:
-    app: {config['name'].split('-')[0]}
+    app: $app
 type: kubernetes.io/tls
 data:
-  tls.crt: {crt_b64}
-  tls.key: {key_b64}
-"""
-    return yaml_content
+""")
+
+def parse_san(san):
+    """Convert an openssl-style SAN string into x509 GeneralNames."""
+    names = []
+    for entry in san.split(','):
+        kind, value = entry.split(':', 1)
+        if kind == 'IP':
+            names.append(x509.IPAddress(ipaddress.ip_address(value)))
+        else:
+            names.append(x509.DNSName(value))
+    return names
+
+def generate_certificate(config):
+    """Generate a self-signed certificate and return the (key, cert) PEM bytes."""
+    if x509 is None:
+        return generate_certificate_openssl(config)
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, config.domain)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(x509.SubjectAlternativeName(parse_san(config.san)), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    crt_pem = cert.public_bytes(serialization.Encoding.PEM)
+
+    # Keep a copy on disk for inspection; the YAML is built from memory
+    with open(os.open(config.key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        f.write(key_pem)
+    with open(config.crt_path, 'wb') as f:
+        f.write(crt_pem)
+
+    return key_pem, crt_pem
+
+def generate_certificate_openssl(config):
+    """Generate a self-signed certificate with the openssl CLI."""
+    cmd = [
+        'openssl', 'req', '-x509', '-nodes', '-days', '365',
+        '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+        '-keyout', config.key_path,
+        '-out', config.crt_path,
+        '-subj', f'/CN={config.domain}',
+        '-addext', f'subjectAltName={config.san}'
+    ]
+
+    # Only stderr is used (for the error message), so don't pipe stdout
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    return Path(config.key_path).read_bytes(), Path(config.crt_path).read_bytes()
+
+def describe_certificate(crt_pem):
+    """Return the validity, subject and SAN lines for a PEM certificate."""
+    if x509 is None:
+        cmd = ['openssl', 'x509', '-text', '-noout']
+        result = subprocess.run(cmd, input=crt_pem, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return [
+            line.strip() for line in result.stdout.decode().split('\n')
+            if 'Subject:' in line or 'Not Before' in line or 'Not After' in line or 'DNS:' in line
+        ]
+
+    cert = x509.load_pem_x509_certificate(crt_pem)
+    san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+    san_names = [
+        f'IP Address:{entry.value}' if isinstance(entry, x509.IPAddress) else f'DNS:{entry.value}'
+        for entry in san
+    ]
+    # The *_utc properties only exist in cryptography >= 42; older releases return naive UTC datetimes
+    not_before = getattr(cert, 'not_valid_before_utc', None) or cert.not_valid_before.replace(tzinfo=datetime.timezone.utc)
+    not_after = getattr(cert, 'not_valid_after_utc', None) or cert.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+    return [
+        f"Not Before: {not_before:%b %d %H:%M:%S %Y} GMT",
+        f"Not After : {not_after:%b %d %H:%M:%S %Y} GMT",
+        f"Subject: {cert.subject.rfc4514_string()}",
+        ', '.join(san_names)
+    ]
+
+def base64_encode_chunks(data):
+    """Yield base64-encoded bytes of PEM data in bounded chunks."""
+    view = memoryview(data)
+    for start in range(0, len(view), B64_CHUNK_SIZE):
+        yield base64.b64encode(view[start:start + B64_CHUNK_SIZE])
+
+def write_k8s_secret_yaml(f, config, crt_pem, key_pem):
+    """Write Kubernetes TLS secret YAML to a binary file, streaming the base64 data fields."""
+    f.write(SECRET_YAML_HEADER.substitute(
+        domain=config.domain,
+        name=config.name,
+        san=config.san,
+        secret_name=config.secret_name,
+        namespace=config.namespace,
+        app=config.name.split('-')[0]
+    ).encode())
+    for key, pem in ((b'tls.crt', crt_pem), (b'tls.key', key_pem)):
+        f.write(b'  ' + key + b': ')
+        for chunk in base64_encode_chunks(pem):
+            f.write(chunk)
+        f.write(b'\n')
 
 def main():
     """Main execution function."""
@@ -103,25 +224,32 @@ def main():
     print("=" * 60)
     print()
 
-    # Generate all certificates
+    # Generate all certificates concurrently - the work happens in libcrypto
+    # or, for the fallback path, in one openssl child process per certificate
+    generated = {}
+    with ThreadPoolExecutor(max_workers=len(CERTS_CONFIG)) as executor:
+        futures = {
+            executor.submit(generate_certificate, config): config.name
+            for config in CERTS_CONFIG
+        }
+        # Report from this thread only, so lines from concurrent workers don't interleave
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                generated[name] = future.result()
+            except subprocess.CalledProcessError as e:
+                print(f"✗ Error generating certificate for {name}: {e.stderr}")
+                raise
+            print(f"✓ Generated certificate for {name}")
+
     cert_data = {}
     for config in CERTS_CONFIG:
-        key_file, crt_file = generate_certificate(
-            config['name'],
-            config['domain'],
-            config['san']
-        )
-
-        # Encode to base64
-        crt_b64 = base64_encode_file(crt_file)
-        key_b64 = base64_encode_file(key_file)
+        key_pem, crt_pem = generated[config.name]
 
-        cert_data[config['name']] = {
+        cert_data[config.name] = {
             'config': config,
-            'crt_b64': crt_b64,
-            'key_b64': key_b64,
-            'key_file': key_file,
-            'crt_file': crt_file
+            'key_pem': key_pem,
+            'crt_pem': crt_pem
         }
 
     print()
@@ -132,19 +260,13 @@ def main():
 
     # Display certificate details
     for name, data in cert_data.items():
-        print(f"Certificate: {data['config']['domain']}")
-        print(f"  Subject Alt Names: {data['config']['san']}")
-        print(f"  YAML file: {data['config']['yaml_file']}")
-
-        # Show cert details
-        crt_file = data['crt_file']
-        cmd = ['openssl', 'x509', '-in', crt_file, '-text', '-noout']
-        result = subprocess.run(cmd, capture_output=True, text=True)
-
-        # Extract subject and dates
-        for line in result.stdout.split('\n'):
-            if 'Subject:' in line or 'Not Before' in line or 'Not After' in line or 'DNS:' in line:
-                print(f"  {line.strip()}")
+        print(f"Certificate: {data['config'].domain}")
+        print(f"  Subject Alt Names: {data['config'].san}")
+        print(f"  YAML file: {data['config'].yaml_file}")
+
+        # Show subject, dates and SANs
+        for line in describe_certificate(data['crt_pem']):
+            print(f"  {line}")
         print()
 
     # Update YAML files
@@ -156,18 +278,11 @@ def main():
     updated_files = []
     for name, data in cert_data.items():
         config = data['config']
-        yaml_path = config['yaml_file']
-
-        # Generate new YAML content
-        yaml_content = generate_k8s_secret_yaml(
-            config,
-            data['crt_b64'],
-            data['key_b64']
-        )
-
-        # Write to file
-        with open(yaml_path, 'w') as f:
-            f.write(yaml_content)
+        yaml_path = config.yaml_file
+
+        # Write new YAML content
+        with open(yaml_path, 'wb') as f:
+            write_k8s_secret_yaml(f, config, data['crt_pem'], data['key_pem'])
 
         print(f"✓ Updated: {yaml_path}")
         updated_files.append(yaml_path)
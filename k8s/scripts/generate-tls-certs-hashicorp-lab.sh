@@ -17,7 +17,7 @@ generate_and_encode_cert() {
 
     echo "Generating certificate for $service ($domain)..."
 
-    openssl req -x509 -nodes -days 365 -newkey rsa:2048 \
+    openssl req -x509 -nodes -days 365 -newkey ec -pkeyopt ec_paramgen_curve:prime256v1 \
       -keyout "$TEMP_DIR/$service.key" \
       -out "$TEMP_DIR/$service.crt" \
       -subj "/CN=$domain" \
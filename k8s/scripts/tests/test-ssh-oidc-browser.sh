@@ -81,7 +81,7 @@ if [[ ! -d "$PLAYWRIGHT_VENV" ]]; then
     echo -e "${BLUE}ℹ️  Creating Playwright venv...${NC}"
     python3 -m venv "$PLAYWRIGHT_VENV"
     source "$PLAYWRIGHT_VENV/bin/activate"
-    pip install playwright --quiet
+    pip install playwright requests --quiet
     echo "Installing Playwright browsers..."
     if ! playwright install chromium 2>&1; then
         echo -e "${YELLOW}⚠️  Warning: Playwright browser installation failed${NC}"
@@ -160,8 +160,8 @@ else
     echo -e "${RED}❌ FAILED${NC}: OIDC + SSH browser flow"
     echo ""
     echo "Troubleshooting:"
-    echo "  1. Check screenshots: ls -la /tmp/ssh-oidc-test-*.png"
-    echo "  2. Run with visible browser: $0 --headed"
+    echo "  1. Check screenshots: ls -la /tmp/ssh-oidc-test-*.jpg"
+    echo "  2. Run with visible browser: $0 --browser-login --headed --debug"
     echo "  3. Verify Keycloak users: ./platform/keycloak/scripts/configure-realm.sh"
     echo "  4. Check OIDC config: boundary auth-methods list"
     exit 1